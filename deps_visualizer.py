@@ -3,20 +3,64 @@ import argparse
 import sys
 import os
 import urllib.request
+import urllib.error
 import tarfile
 import gzip
 import io
+import re
+import hashlib
+import json
+import pickle
+import tempfile
 from urllib.parse import urljoin, urlparse
 from collections import defaultdict
 
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+try:
+    import libarchive
+except (ImportError, OSError):
+    # OSError: модуль установлен, но системная библиотека libarchive не найдена
+    libarchive = None
+
+# Размер буфера чтения архива: крупные блоки уменьшают число системных вызовов
+READ_BUFFER_SIZE = 128 * 1024
+
+# Допустимые значения параметров командной строки
+ALLOWED_MODES = frozenset(('online', 'offline', 'test'))
+TRUE_VALUES = frozenset(('true', '1', 'yes', 'on'))
+FALSE_VALUES = frozenset(('false', '0', 'no', 'off'))
+# Символы, недопустимые в имени пакета (пробелы и разделители путей)
+INVALID_PACKAGE_CHARS_RE = re.compile(r'[ /\\]')
+
+# Регулярные выражения для разбора записей APKINDEX
+APKINDEX_FIELD_RE = re.compile(rb'^([PD]):(.*)$', re.MULTILINE)
+VERSION_OPERATOR_RE = re.compile(rb'[<>=!~]')
+# Строка тестового репозитория вида "пакет: зависимости" (пустые строки и комментарии # пропускаются)
+TEST_REPO_LINE_RE = re.compile(r'^[ \t]*(?![#\s])([^:\n]*):(.*)$', re.MULTILINE)
+
+# Общий пустой список зависимостей для отсутствующих пакетов (без выделения памяти)
+EMPTY_DEPS = ()
+
+# Версия формата кэша: меняется при изменении структуры разобранного индекса
+CACHE_FORMAT_VERSION = 3
+
+# Каталог кэша разобранных APKINDEX
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                         'deps_visualizer')
+# Сколько разобранных индексов хранить в кэше (остальные удаляются, начиная с давно не использованных)
+CACHE_MAX_ENTRIES = 4
+
 
 def validate_package_name(name: str) -> str:
     if not name or not isinstance(name, str):
         raise ValueError("Имя пакета не может быть пустым.")
     name = name.strip()
-    if not name.replace('-', '_').replace('.', '_').replace('+', '_').isidentifier():
-        if ' ' in name or '/' in name or '\\' in name:
-            raise ValueError("Имя пакета не должно содержать пробелов или путей.")
+    if INVALID_PACKAGE_CHARS_RE.search(name):
+        raise ValueError("Имя пакета не должно содержать пробелов или путей.")
     return name
 
 
@@ -33,9 +77,9 @@ def validate_repo_url_or_path(repo: str) -> str:
 
 
 def validate_mode(mode: str) -> str:
-    allowed = {'online', 'offline', 'test'}
-    if mode not in allowed:
-        raise ValueError(f"Режим работы должен быть одним из: {', '.join(allowed)}. Получено: '{mode}'.")
+    if mode not in ALLOWED_MODES:
+        raise ValueError(f"Режим работы должен быть одним из: {', '.join(sorted(ALLOWED_MODES))}. "
+                         f"Получено: '{mode}'.")
     return mode
 
 
@@ -47,13 +91,19 @@ def validate_output_file(filename: str) -> str:
     return filename
 
 
-def validate_ascii_tree(mode: str) -> bool:
-    if mode.lower() in ('true', '1', 'yes', 'on'):
+def parse_bool(value: str, what: str) -> bool:
+    """Разбирает булево значение параметра; what — название параметра для сообщения об ошибке."""
+    normalized = value.strip().lower()
+    if normalized in TRUE_VALUES:
         return True
-    elif mode.lower() in ('false', '0', 'no', 'off'):
+    elif normalized in FALSE_VALUES:
         return False
     else:
-        raise ValueError("Режим ASCII-дерева должен быть булевым: true/false, yes/no, 1/0 и т.п.")
+        raise ValueError(f"{what} должен быть булевым: true/false, yes/no, 1/0 и т.п.")
+
+
+def validate_ascii_tree(mode: str) -> bool:
+    return parse_bool(mode, "Режим ASCII-дерева")
 
 
 def safe_mermaid_id(name: str) -> str:
@@ -76,102 +126,299 @@ def safe_mermaid_id(name: str) -> str:
     return cleaned
 
 
-def fetch_apkindex_content(repo_url: str) -> str:
-    """Загружает и распаковывает APKINDEX.tar.gz, возвращает содержимое APKINDEX."""
+def open_gzip_stream(fileobj):
+    """
+    Возвращает поток распакованных данных gzip.
+    Если установлен rapidgzip и поток поддерживает seek, распаковка
+    выполняется параллельно на всех ядрах, иначе используется gzip.
+    """
+    if rapidgzip is not None and fileobj.seekable():
+        return rapidgzip.RapidgzipFile(fileobj, parallelization=os.cpu_count())
+    # APKINDEX.tar.gz состоит из нескольких gzip-потоков (подпись и сам индекс);
+    # режим tarfile 'r|gz' читает только первый из них, GzipFile — все подряд
+    return gzip.GzipFile(fileobj=fileobj)
+
+
+def get_apkindex_url(repo_url: str):
+    """Возвращает HTTP(S)-адрес APKINDEX.tar.gz или None, если репозиторий локальный."""
+    if repo_url.startswith(('http://', 'https://')):
+        return repo_url
+    elif repo_url.startswith('file://') or os.path.isfile(repo_url):
+        return None
+    else:
+        return repo_url.rstrip('/') + '/APKINDEX.tar.gz'
+
+
+def open_apkindex_source(repo_url: str, validators: dict = None):
+    """
+    Открывает APKINDEX.tar.gz (URL или локальный файл) как буферизованный бинарный поток.
+    Если переданы validators ({'etag': ..., 'last_modified': ...}), HTTP-запрос
+    выполняется условно, а словарь обновляется значениями из ответа сервера.
+    """
+    url = get_apkindex_url(repo_url)
+    if url is None:
+        local_path = repo_url[7:] if repo_url.startswith('file://') else repo_url
+        return open(local_path, 'rb', buffering=READ_BUFFER_SIZE)
+
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    response = urllib.request.urlopen(urllib.request.Request(url, headers=headers))
+    if validators is not None:
+        validators['etag'] = response.headers.get('ETag')
+        validators['last_modified'] = response.headers.get('Last-Modified')
+    return io.BufferedReader(response, buffer_size=READ_BUFFER_SIZE)
+
+
+def read_apkindex_with_tarfile(source) -> bytes:
+    """Извлекает APKINDEX из потока APKINDEX.tar.gz средствами gzip/tarfile."""
+    with open_gzip_stream(source) as tar_stream, \
+            tarfile.open(fileobj=tar_stream, mode='r|', bufsize=READ_BUFFER_SIZE) as tar:
+        for member in tar:
+            if member.name == 'APKINDEX':
+                f = tar.extractfile(member)
+                if f:
+                    return f.read()
+    raise FileNotFoundError("Файл APKINDEX не найден внутри APKINDEX.tar.gz")
+
+
+def read_apkindex_with_libarchive(source) -> bytes:
+    """Извлекает APKINDEX из потока APKINDEX.tar.gz средствами libarchive (распаковка и разбор tar на C)."""
+    with libarchive.stream_reader(source, block_size=READ_BUFFER_SIZE) as archive:
+        for entry in archive:
+            if entry.pathname == 'APKINDEX':
+                return b''.join(entry.get_blocks())
+    raise FileNotFoundError("Файл APKINDEX не найден внутри APKINDEX.tar.gz")
+
+
+def fetch_apkindex_content(repo_url: str, validators: dict = None):
+    """
+    Загружает и распаковывает APKINDEX.tar.gz, возвращает содержимое APKINDEX
+    в виде байтов (без декодирования).
+    Архив читается потоком: сжатые данные не буферизуются в памяти целиком.
+    При условном запросе возвращает None, если сервер ответил 304 Not Modified.
+    """
     try:
-        if repo_url.startswith(('http://', 'https://')):
-            with urllib.request.urlopen(repo_url) as response:
-                compressed_data = response.read()
-        elif repo_url.startswith('file://'):
-            local_path = repo_url[7:]
-            with open(local_path, 'rb') as f:
-                compressed_data = f.read()
-        elif os.path.isfile(repo_url):
-            with open(repo_url, 'rb') as f:
-                compressed_data = f.read()
-        else:
-            repo_url = repo_url.rstrip('/') + '/APKINDEX.tar.gz'
-            with urllib.request.urlopen(repo_url) as response:
-                compressed_data = response.read()
-
-        decompressed = gzip.decompress(compressed_data)
-        tar_stream = io.BytesIO(decompressed)
-        with tarfile.open(fileobj=tar_stream, mode='r') as tar:
-            for member in tar.getmembers():
-                if member.name == 'APKINDEX':
-                    f = tar.extractfile(member)
-                    if f:
-                        return f.read().decode('utf-8')
-            raise FileNotFoundError("Файл APKINDEX не найден внутри APKINDEX.tar.gz")
+        try:
+            source = open_apkindex_source(repo_url, validators)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+        with source:
+            # Параллельная распаковка rapidgzip выгоднее, если она применима;
+            # иначе предпочитаем libarchive, а без него — стандартную библиотеку
+            if libarchive is not None and not (rapidgzip is not None and source.seekable()):
+                return read_apkindex_with_libarchive(source)
+            return read_apkindex_with_tarfile(source)
     except Exception as e:
         raise RuntimeError(f"Не удалось загрузить или распаковать APKINDEX: {e}")
 
 
-def parse_apkindex_to_dict(apkindex_content: str) -> dict:
-    """Парсит APKINDEX и возвращает словарь {пакет: [зависимости]}."""
+def parse_apkindex_to_dict(apkindex_content: bytes) -> dict:
+    """
+    Парсит APKINDEX и возвращает словарь {пакет: (зависимости,)}.
+    Один проход регулярного выражения по исходному буферу извлекает только
+    строки P: и D:; строка D: относится к последнему встреченному P:
+    (в записи APKINDEX она всегда идёт после P:).
+    Разбор идёт по байтам, в строки декодируются только имена пакетов.
+    """
     packages = {}
+    intern = sys.intern  # одно и то же имя встречается во многих списках зависимостей
+    shared_deps = {}  # одинаковые наборы зависимостей хранятся одним кортежем
     current_pkg = None
-    current_deps = []
-
-    for line in apkindex_content.splitlines():
-        line = line.strip()
-        if line.startswith('P:'):
-            if current_pkg is not None:
-                packages[current_pkg] = current_deps
-            current_pkg = line[2:].strip()
-            current_deps = []
-        elif line.startswith('D:'):
-            deps_str = line[2:].strip()
-            if deps_str:
-                raw_deps = deps_str.split()
-                clean_deps = []
-                for d in raw_deps:
-                    if d.startswith('so:'):
-                        continue
-                    pkg_name = d.split('>=')[0].split('<=')[0].split('=')[0].split('!')[0].strip()
-                    clean_deps.append(pkg_name)
-                current_deps = clean_deps
-            else:
-                current_deps = []
-        elif line == '':
-            if current_pkg is not None:
-                packages[current_pkg] = current_deps
-                current_pkg = None
-                current_deps = []
+    own_name = None
 
-    if current_pkg is not None:
-        packages[current_pkg] = current_deps
+    for field in APKINDEX_FIELD_RE.finditer(apkindex_content):
+        if field.group(1) == b'P':
+            own_name = field.group(2).strip()
+            current_pkg = intern(own_name.decode('utf-8'))
+            packages[current_pkg] = EMPTY_DEPS
+            continue
+
+        if current_pkg is None:
+            continue
 
+        clean_deps = []
+        # После отбрасывания версий python3~3.11 и python3 дают одно имя, поэтому
+        # повторы пропускаются; собственное имя записи (ограничение версии на
+        # самого себя) — не зависимость
+        seen = {own_name}
+        for d in field.group(2).split():
+            if d[:3] == b'so:':
+                continue
+            # Имя заканчивается на первом операторе версии; конфликты (!pkg) дают пустое имя
+            op_match = VERSION_OPERATOR_RE.search(d)
+            pkg_name = d[:op_match.start()] if op_match else d
+            if pkg_name and pkg_name not in seen:
+                seen.add(pkg_name)
+                clean_deps.append(intern(pkg_name.decode('utf-8')))
+
+        deps = tuple(clean_deps)
+        packages[current_pkg] = shared_deps.setdefault(deps, deps)
+
+    return packages
+
+
+def load_cached_index(key: str):
+    """Возвращает закэшированный словарь пакетов по ключу или None, если кэша нет."""
+    cache_path = os.path.join(CACHE_DIR, key + '.pkl')
+    try:
+        with open(cache_path, 'rb') as f:
+            packages = pickle.load(f)
+    except Exception:
+        return None
+    try:
+        # Время изменения отмечает последнее использование для prune_index_cache
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return packages
+
+
+def save_cached_index(key: str, packages: dict) -> None:
+    """
+    Атомарно сохраняет словарь пакетов в кэш.
+    Ошибки записи не критичны и игнорируются.
+    """
+    cache_path = os.path.join(CACHE_DIR, key + '.pkl')
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(packages, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    prune_index_cache(key)
+
+
+def prune_index_cache(current_key: str) -> None:
+    """
+    Удаляет устаревшие разобранные индексы: файлы прошлых версий формата кэша
+    и все, кроме CACHE_MAX_ENTRIES последних использованных (включая current_key).
+    Ошибки удаления не критичны и игнорируются.
+    """
+    prefix = f"v{CACHE_FORMAT_VERSION}-"
+    current_name = current_key + '.pkl'
+    entries = []
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for entry in it:
+                name = entry.name
+                if not name.endswith('.pkl') or name == current_name:
+                    continue
+                if name.startswith(prefix):
+                    entries.append((entry.stat().st_mtime, entry.path))
+                else:
+                    os.remove(entry.path)
+        entries.sort(reverse=True)
+        for _, path in entries[CACHE_MAX_ENTRIES - 1:]:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def apkindex_cache_key(apkindex_content: bytes) -> str:
+    """Возвращает ключ кэша для содержимого APKINDEX с учётом версии формата кэша."""
+    return f"v{CACHE_FORMAT_VERSION}-{hashlib.sha256(apkindex_content).hexdigest()}"
+
+
+def parse_apkindex_cached(apkindex_content: bytes, key: str = None) -> dict:
+    """
+    Парсит APKINDEX с использованием дискового кэша.
+    Ключ кэша — SHA-256 содержимого, поэтому неизменённый индекс
+    повторно не разбирается.
+    """
+    if key is None:
+        key = apkindex_cache_key(apkindex_content)
+    packages = load_cached_index(key)
+    if packages is None:
+        print("Парсинг APKINDEX...")
+        packages = parse_apkindex_to_dict(apkindex_content)
+        save_cached_index(key, packages)
+    else:
+        print("Разобранный APKINDEX загружен из кэша.")
+    return packages
+
+
+def load_apkindex(repo_url: str) -> dict:
+    """
+    Загружает и разбирает APKINDEX с использованием кэша.
+    Для HTTP-репозиториев сохраняются ETag и Last-Modified ответа; при
+    следующем запуске запрос выполняется условно, и при ответе
+    304 Not Modified индекс берётся из кэша без загрузки.
+    """
+    if get_apkindex_url(repo_url) is None:
+        return parse_apkindex_cached(fetch_apkindex_content(repo_url))
+
+    meta_path = os.path.join(CACHE_DIR, hashlib.sha256(repo_url.encode('utf-8')).hexdigest() + '.json')
+    validators = {}
+    cached = None
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            validators = json.load(f)
+        cached = load_cached_index(validators['key'])
+    except Exception:
+        pass
+    if cached is None:
+        # Без разобранного индекса условный запрос бесполезен
+        validators = {}
+
+    apkindex_content = fetch_apkindex_content(repo_url, validators)
+    if apkindex_content is None:
+        print("APKINDEX на сервере не изменился, используется разобранный индекс из кэша.")
+        return cached
+
+    key = apkindex_cache_key(apkindex_content)
+    packages = parse_apkindex_cached(apkindex_content, key)
+    validators['key'] = key
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(validators, f)
+    except OSError:
+        pass
     return packages
 
 
 def load_test_repo(file_path: str) -> dict:
     """Загружает тестовый репозиторий из файла."""
     repo = {}
+    intern = sys.intern
+    shared_deps = {}
     try:
-        with open(file_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                if ':' not in line:
-                    continue
-                pkg, deps_part = line.split(':', 1)
-                pkg = pkg.strip()
-                deps_part = deps_part.strip()
-                if deps_part:
-                    dependencies = deps_part.split()
-                else:
-                    dependencies = []
-                repo[pkg] = dependencies
+        with open(file_path, 'r', buffering=READ_BUFFER_SIZE) as f:
+            data = f.read()
+        for pkg, deps_part in TEST_REPO_LINE_RE.findall(data):
+            # Повторы в строке зависимостей пропускаются, как и в parse_apkindex_to_dict
+            deps = tuple(dict.fromkeys(intern(dep) for dep in deps_part.split()))
+            repo[intern(pkg.strip())] = shared_deps.setdefault(deps, deps)
         return repo
     except Exception as e:
         raise RuntimeError(f"Не удалось загрузить тестовый репозиторий из {file_path}: {e}")
 
 
-def build_dependency_graph_dfs(start_package: str, get_deps_func) -> tuple:
+def format_dependency_line(pkg: str, deps) -> str:
+    """Форматирует строку вида 'пакет -> зависимости' для вывода графа."""
+    if deps:
+        return f"{pkg} -> {', '.join(deps)}"
+    return f"{pkg} -> (нет зависимостей)"
+
+
+def build_dependency_graph_dfs(start_package: str, repo_data: dict, emit=None) -> tuple:
     """
     Строит граф зависимостей с помощью DFS без рекурсии.
+    Зависимости берутся напрямую из repo_data ({пакет: [зависимости]}).
+    Если передан emit, он вызывается как emit(пакет, зависимости) при первом
+    посещении каждого пакета — в том же порядке, что и ключи графа.
+    Значения графа — те же кортежи зависимостей, что и в repo_data (без копирования).
     Возвращает (граф, есть_цикла)
     """
     graph = {}
@@ -180,72 +427,110 @@ def build_dependency_graph_dfs(start_package: str, get_deps_func) -> tuple:
     in_stack = set()
     has_cycle = False
 
+    # Локальные ссылки на методы экономят поиск атрибутов на каждом узле
+    get_deps = repo_data.get
+    stack_append = stack.append
+    stack_pop = stack.pop
+    visited_add = visited.add
+    in_stack_add = in_stack.add
+    in_stack_remove = in_stack.remove
+
     while stack:
-        node, processed = stack.pop()
+        node, processed = stack_pop()
 
         if processed:
-            in_stack.remove(node)
+            in_stack_remove(node)
             continue
 
-        if node in visited:
-            continue
-
-        # Проверка на цикл
+        # Проверка на цикл: узел ещё на текущем пути обхода — обратное ребро.
+        # Должна идти до проверки visited, иначе цикл никогда не обнаруживается
         if node in in_stack:
             has_cycle = True
             continue
 
-        in_stack.add(node)
-        visited.add(node)
+        if node in visited:
+            continue
+
+        in_stack_add(node)
+        visited_add(node)
 
-        dependencies = get_deps_func(node)
-        graph[node] = dependencies.copy()
+        dependencies = get_deps(node, EMPTY_DEPS)
+        graph[node] = dependencies
+        if emit is not None:
+            emit(node, dependencies)
 
         # Сначала добавляем текущий узел с флагом processed=True
-        stack.append((node, True))
+        stack_append((node, True))
 
-        # Затем добавляем все зависимости для обработки
-        for dep in reversed(dependencies):
-            stack.append((dep, False))
+        # Затем добавляем все зависимости для обработки (в обратном порядке)
+        for i in range(len(dependencies) - 1, -1, -1):
+            stack_append((dependencies[i], False))
 
     return graph, has_cycle
 
 
 def build_reverse_dependency_graph(target_package: str, repo_data: dict) -> list:
     """
-    Строит список пакетов, которые зависят от target_package.
+    Строит список пакетов, которые зависят от target_package,
+    за один проход по репозиторию.
     """
-    reverse_deps = []
+    return [package for package, dependencies in repo_data.items()
+            if target_package in dependencies]
 
-    for package, dependencies in repo_data.items():
-        if target_package in dependencies:
-            reverse_deps.append(package)
 
-    return reverse_deps
+def tree_lines(graph: dict, root: str):
+    """
+    Генерирует строки ASCII-дерева зависимостей для пакета root.
+    Каждый пакет раскрывается только один раз: повторная встреча пакета
+    в другой ветке помечается "(см. выше)", а повтор на текущем пути —
+    "(цикл)". Поэтому размер вывода линеен по числу рёбер графа, а не
+    экспоненциален для общих поддеревьев.
+    Обход выполняется без рекурсии, поэтому глубина графа не ограничена
+    лимитом рекурсии Python; строки выдаются лениво.
+    """
+    path = set()  # пакеты на текущем пути от корня; повтор на пути означает цикл
+    printed = set()  # пакеты, поддерево которых уже выведено
+    stack = [(root, "", True, False)]  # (узел, префикс, последний среди соседей, флаг выхода)
 
+    # Локальные ссылки на методы экономят поиск атрибутов на каждом узле
+    push = stack.append
+    pop = stack.pop
 
-def print_graph(graph: dict, start_package: str) -> None:
-    """Выводит граф зависимостей в виде дерева."""
+    while stack:
+        pkg, prefix, is_last, leaving = pop()
+
+        if leaving:
+            path.discard(pkg)
+            continue
+
+        branch = "└── " if is_last else "├── "
+
+        if pkg in path:
+            yield f"{prefix}{branch}{pkg} (цикл)"
+            continue
+
+        if pkg in printed:
+            yield f"{prefix}{branch}{pkg} (см. выше)"
+            continue
 
-    def print_dependencies(pkg, indent="", visited=None):
-        if visited is None:
-            visited = set()
-        if pkg in visited:
-            print(f"{indent}└── {pkg} (цикл)")
-            return
-        visited.add(pkg)
+        yield f"{prefix}{branch}{pkg}"
+        path.add(pkg)
+        printed.add(pkg)
 
-        deps = graph.get(pkg, [])
-        print(f"{indent}└── {pkg}")
+        # Метка выхода снимает узел с пути после обхода всех его зависимостей
+        push((pkg, prefix, is_last, True))
 
-        if deps:
-            for i, dep in enumerate(deps):
-                is_last = (i == len(deps) - 1)
-                new_indent = indent + ("    " if is_last else "│   ")
-                print_dependencies(dep, new_indent, visited.copy())
+        deps = graph.get(pkg, EMPTY_DEPS)
+        child_prefix = prefix + ("    " if is_last else "│   ")
+        last_idx = len(deps) - 1
+        for i in range(last_idx, -1, -1):
+            push((deps[i], child_prefix, i == last_idx, False))
 
-    print(f"Граф зависимостей для пакета {start_package}:")
-    print_dependencies(start_package)
+
+def print_graph(graph: dict, start_package: str) -> None:
+    """Выводит граф зависимостей в виде дерева."""
+    sys.stdout.write(f"Граф зависимостей для пакета {start_package}:\n")
+    sys.stdout.writelines(line + "\n" for line in tree_lines(graph, start_package))
 
 
 def generate_mermaid_code(dependency_graph: dict, start_package: str) -> str:
@@ -256,15 +541,16 @@ def generate_mermaid_code(dependency_graph: dict, start_package: str) -> str:
     lines = ["graph TD"]
     node_ids = {}  # Словарь для соответствия оригинальных имен и идентификаторов
 
-    # Собираем все уникальные узлы и создаем безопасные идентификаторы
-    nodes = set()
-    for pkg, deps in dependency_graph.items():
-        nodes.add(pkg)
-        for dep in deps:
-            nodes.add(dep)
+    # Один раз сортируем записи графа: это задаёт порядок и узлов, и связей
+    items = sorted(dependency_graph.items())
+    nodes = [pkg for pkg, _ in items]
+    # Зависимости без собственной записи в графе (DFS обычно добавляет все узлы)
+    extra_nodes = {dep for _, deps in items for dep in deps if dep not in dependency_graph}
+    if extra_nodes:
+        nodes = sorted(nodes + list(extra_nodes))
 
     # Создаем идентификаторы для всех узлов
-    for node in sorted(nodes):
+    for node in nodes:
         safe_id = safe_mermaid_id(node)
         node_ids[node] = safe_id
         # Для стартового пакета используем жирный шрифт
@@ -273,16 +559,11 @@ def generate_mermaid_code(dependency_graph: dict, start_package: str) -> str:
         else:
             lines.append(f'    {safe_id}["{node}"]')
 
-    # Добавляем связи
-    edges = set()
-    for pkg, deps in dependency_graph.items():
-        for dep in deps:
-            edges.add((pkg, dep))
-
-    for pkg, dep in sorted(edges):
+    # Добавляем связи в порядке отсортированных записей, без повторов
+    for pkg, deps in items:
         pkg_id = node_ids[pkg]
-        dep_id = node_ids[dep]
-        lines.append(f"    {pkg_id} --> {dep_id}")
+        for dep in sorted(set(deps)):
+            lines.append(f"    {pkg_id} --> {node_ids[dep]}")
 
     # Добавляем стиль для лучшей читаемости
     lines.append("")
@@ -325,10 +606,17 @@ def compare_with_standard_tools(package: str, mode: str, repo: str):
         print("В тестовом режиме сравнение со штатными инструментами не выполняется.")
 
 
-def demonstrate_three_packages(repo_data, get_deps_func, mode, ascii_tree, output_prefix):
+def demonstrate_three_packages(repo_data, mode, ascii_tree, output_prefix, graph_cache=None,
+                               verbose_mermaid=False):
     """
     Демонстрирует визуализацию для трех различных пакетов.
+    graph_cache — словарь {пакет: (граф, есть_цикла)} с уже построенными графами;
+    пополняется построенными здесь графами.
+    Код Mermaid выводится в консоль только при verbose_mermaid.
     """
+    if graph_cache is None:
+        graph_cache = {}
+
     print("\n=== Демонстрация визуализации зависимостей для трех различных пакетов ===")
 
     # Выбираем три пакета для демонстрации
@@ -364,13 +652,16 @@ def demonstrate_three_packages(repo_data, get_deps_func, mode, ascii_tree, outpu
         else:
             print("  Нет прямых зависимостей")
 
-        # Строим граф зависимостей
-        pkg_graph, has_cycle = build_dependency_graph_dfs(pkg, get_deps_func)
+        # Строим граф зависимостей, если он ещё не был построен
+        if pkg not in graph_cache:
+            graph_cache[pkg] = build_dependency_graph_dfs(pkg, repo_data)
+        pkg_graph, has_cycle = graph_cache[pkg]
 
         # Генерируем код Mermaid
         pkg_mermaid_code = generate_mermaid_code(pkg_graph, pkg)
-        print("\nКод Mermaid:")
-        print(pkg_mermaid_code)
+        if verbose_mermaid:
+            print("\nКод Mermaid:")
+            sys.stdout.write(pkg_mermaid_code + "\n")
 
         # Сохраняем изображение
         pkg_output = f"{output_prefix}_{pkg}.mmd"
@@ -382,28 +673,51 @@ def demonstrate_three_packages(repo_data, get_deps_func, mode, ascii_tree, outpu
             print_graph(pkg_graph, pkg)
 
 
+def argparse_type(validator):
+    """
+    Оборачивает валидатор для использования в качестве type= в argparse:
+    ValueError превращается в ArgumentTypeError с тем же сообщением.
+    """
+    def convert(value):
+        try:
+            return validator(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
+    convert.__name__ = validator.__name__
+    return convert
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Инструмент визуализации графа зависимостей пакетов Alpine Linux.",
         formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument('--package', required=True, help='Имя анализируемого пакета.')
-    parser.add_argument('--repo', required=True, help='URL репозитория или путь к файлу тестового репозитория.')
-    parser.add_argument('--mode', required=True, choices=['online', 'offline', 'test'],
+    # Валидация выполняется самим argparse при разборе аргументов
+    parser.add_argument('--package', required=True, type=argparse_type(validate_package_name),
+                        help='Имя анализируемого пакета.')
+    parser.add_argument('--repo', required=True, type=argparse_type(validate_repo_url_or_path),
+                        help='URL репозитория или путь к файлу тестового репозитория.')
+    parser.add_argument('--mode', required=True, type=argparse_type(validate_mode),
+                        metavar='{' + ','.join(sorted(ALLOWED_MODES)) + '}',
                         help='Режим работы с тестовым репозиторием.')
-    parser.add_argument('--output', required=True,
+    parser.add_argument('--output', required=True, type=argparse_type(validate_output_file),
                         help='Имя сгенерированного файла с кодом Mermaid (с расширением .mmd).')
-    parser.add_argument('--ascii-tree', required=True, help='Режим вывода зависимостей в формате ASCII-дерева.')
+    parser.add_argument('--ascii-tree', required=True, type=argparse_type(validate_ascii_tree),
+                        help='Режим вывода зависимостей в формате ASCII-дерева.')
+    parser.add_argument('--verbose-mermaid', action='store_true',
+                        help='Выводить код Mermaid в консоль (по умолчанию он только сохраняется в файл).')
 
     try:
         args = parser.parse_args()
 
-        # === Этап 1: валидация и вывод параметров ===
-        package = validate_package_name(args.package)
-        repo = validate_repo_url_or_path(args.repo)
-        mode = validate_mode(args.mode)
-        output = validate_output_file(args.output)
-        ascii_tree = validate_ascii_tree(args.ascii_tree)
+        # === Этап 1: вывод параметров (значения уже проверены argparse) ===
+        package = sys.intern(args.package)
+        repo = args.repo
+        mode = args.mode
+        output = args.output
+        ascii_tree = args.ascii_tree
+        verbose_mermaid = args.verbose_mermaid
 
         print("Параметры запуска:")
         print(f"package = {package}")
@@ -411,6 +725,7 @@ def main():
         print(f"mode = {mode}")
         print(f"output = {output}")
         print(f"ascii_tree = {ascii_tree}")
+        print(f"verbose_mermaid = {verbose_mermaid}")
         print()
 
         # === Этап 2: получение данных репозитория в зависимости от режима ===
@@ -421,38 +736,24 @@ def main():
             print(f"Тестовый репозиторий загружен. Всего пакетов: {len(repo_data)}")
         else:
             print(f"Загрузка APKINDEX из: {repo}")
-            apkindex_content = fetch_apkindex_content(repo)
-            print("Парсинг APKINDEX...")
-            repo_data = parse_apkindex_to_dict(apkindex_content)
+            repo_data = load_apkindex(repo)
             print(f"Загружено записей о пакетах: {len(repo_data)}")
 
-        # Проверяем наличие начального пакета
-        if package not in repo_data:
-            print(f"Предупреждение: пакет '{package}' не найден в репозитории.", file=sys.stderr)
-            dependencies = []
-        else:
-            dependencies = repo_data[package]
-
-        if dependencies:
-            print(f"\nПрямые зависимости пакета '{package}':")
-            for dep in dependencies:
-                print(f"  - {dep}")
-        else:
-            print(f"\nПакет '{package}' не имеет прямых зависимостей или не найден в репозитории.")
-
-        # === Этап 3: построение графа зависимостей ===
-        print("\n=== Этап 3: Построение графа зависимостей ===")
-
-        def get_deps(pkg_name):
-            return repo_data.get(pkg_name, [])
-
+        # Проверяем наличие начального пакета: без него дальнейшие этапы невозможны
         if package not in repo_data:
             print(f"Ошибка: стартовый пакет '{package}' отсутствует в репозитории. Невозможно построить граф.",
                   file=sys.stderr)
             sys.exit(1)
 
+        # === Этап 3: построение графа зависимостей ===
+        print("\n=== Этап 3: Построение графа зависимостей ===")
+
         try:
-            graph, has_cycle = build_dependency_graph_dfs(package, get_deps)
+            # Строки списка зависимостей формируются прямо во время обхода
+            graph_lines = []
+            graph, has_cycle = build_dependency_graph_dfs(
+                package, repo_data,
+                lambda pkg, deps: graph_lines.append(format_dependency_line(pkg, deps)))
             print("Граф зависимостей успешно построен.")
 
             if has_cycle:
@@ -461,11 +762,7 @@ def main():
                 print("Циклические зависимости не обнаружены.")
 
             print("\nГраф зависимостей (все зависимости):")
-            for pkg, deps in graph.items():
-                if deps:
-                    print(f"{pkg} -> {', '.join(deps)}")
-                else:
-                    print(f"{pkg} -> (нет зависимостей)")
+            sys.stdout.write("\n".join(graph_lines) + "\n")
 
             if ascii_tree:
                 print("\nГраф зависимостей в виде ASCII-дерева:")
@@ -482,11 +779,6 @@ def main():
         # === Этап 4: вывод обратных зависимостей ===
         print("\n=== Этап 4: Вывод обратных зависимостей ===")
 
-        if package not in repo_data:
-            print(f"Ошибка: пакет '{package}' отсутствует в репозитории. Невозможно найти обратные зависимости.",
-                  file=sys.stderr)
-            sys.exit(1)
-
         try:
             reverse_deps = build_reverse_dependency_graph(package, repo_data)
             if reverse_deps:
@@ -518,8 +810,9 @@ def main():
         try:
             # Генерируем код Mermaid
             mermaid_code = generate_mermaid_code(graph, package)
-            print("\nКод Mermaid для визуализации графа:")
-            print(mermaid_code)
+            if verbose_mermaid:
+                print("\nКод Mermaid для визуализации графа:")
+                sys.stdout.write(mermaid_code + "\n")
 
             # Сохраняем код Mermaid
             save_mermaid_code(mermaid_code, output)
@@ -528,7 +821,9 @@ def main():
             compare_with_standard_tools(package, mode, repo)
 
             # Демонстрация для трех пакетов
-            demonstrate_three_packages(repo_data, get_deps, mode, ascii_tree, output.rsplit('.', 1)[0])
+            demonstrate_three_packages(repo_data, mode, ascii_tree, output.rsplit('.', 1)[0],
+                                       graph_cache={package: (graph, has_cycle)},
+                                       verbose_mermaid=verbose_mermaid)
 
             print("\nЭтап 5 успешно завершен. Код Mermaid сохранен в файл(ы).")
 